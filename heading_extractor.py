@@ -1,7 +1,9 @@
 import os
+import functools
 import fitz  # PyMuPDF
 import json
-from collections import Counter, defaultdict
+import numpy as np
+from collections import namedtuple
 
 # Heuristic: Use font size and font weight to classify headings
 HEADING_LEVELS = ['Title', 'H1', 'H2', 'H3']
@@ -19,26 +21,52 @@ def clean_heading_text(text):
     return text
 
 
-def extract_lines_with_fonts(pdf_path):
+@functools.lru_cache(maxsize=8)
+def _parse_pdf(pdf_path, mtime):
+    """Parse the PDF in a single pass, returning font-annotated lines and per-page plain text.
+
+    The "dict" extraction is the dominant cost per page, so we decode it exactly
+    once and derive both the heading-detection lines and the plain text used for
+    chunking from the same result. Cached on (path, mtime) so repeated calls for
+    the same file reuse the parse.
+    """
     doc = fitz.open(pdf_path)
     lines = []
+    page_texts = []
     for page_num, page in enumerate(doc, start=1):
+        # Cheap probe first: plain "text" extraction is an order of magnitude
+        # cheaper than "dict", so blank/image-only pages skip the full decode
+        if not page.get_text("text").strip():
+            page_texts.append('')
+            continue
         blocks = page.get_text("dict")['blocks']
+        text_lines = []
         for block in blocks:
             if block['type'] != 0:
                 continue
             for line in block['lines']:
-                line_text = " ".join([span['text'] for span in line['spans']]).strip()
+                # Single pass over spans: collect text, largest font size (usually
+                # heading), font-name counts, bold flag, and top y-coordinate
+                text_parts = []
+                font_counts = {}
+                max_font_size = 0.0
+                is_bold = False
+                y_coord = float('inf')
+                for span in line['spans']:
+                    text_parts.append(span['text'])
+                    if span['size'] > max_font_size:
+                        max_font_size = span['size']
+                    font = span['font']
+                    font_counts[font] = font_counts.get(font, 0) + 1
+                    if not is_bold and 'bold' in font.lower():
+                        is_bold = True
+                    if span['bbox'][1] < y_coord:
+                        y_coord = span['bbox'][1]
+                line_text = " ".join(text_parts).strip()
                 if not line_text:
                     continue
-                # Use the largest font size in the line (usually heading)
-                max_font_size = max(span['size'] for span in line['spans'])
-                # Use the most common font name in the line
-                font_names = [span['font'] for span in line['spans']]
-                font_name = Counter(font_names).most_common(1)[0][0]
-                is_bold = any('Bold' in fn or 'bold' in fn for fn in font_names)
-                # Get y-coordinate for positioning
-                y_coord = min(span['bbox'][1] for span in line['spans'])
+                # Most common font name in the line
+                font_name = max(font_counts, key=font_counts.get)
                 lines.append({
                     'text': line_text,
                     'page': page_num - 1,  # page numbers start from 0
@@ -47,159 +75,205 @@ def extract_lines_with_fonts(pdf_path):
                     'is_bold': is_bold,
                     'y_coord': y_coord
                 })
-    return lines
+                # For the chunking text, spans concatenate with no separator --
+                # that's what page.get_text() produces; the space-join above is
+                # only for the heading-detection lines
+                text_lines.append(''.join(text_parts).strip())
+        page_texts.append('\n'.join(text_lines))
+    doc.close()
+    return lines, page_texts
+
+
+def parse_pdf(pdf_path):
+    """Single-pass parse of a PDF, memoized on (path, mtime)."""
+    return _parse_pdf(os.path.abspath(pdf_path), os.path.getmtime(pdf_path))
+
+
+def extract_lines_with_fonts(pdf_path):
+    return parse_pdf(pdf_path)[0]
+
+
+# Common form/table patterns (e.g., 'S.No', 'Name', 'Age', 'Date') that should
+# never become headings
+SKIP_PATTERNS = frozenset({'s.no', 'name', 'age', 'date', 'rs.', 'signature'})
+
+
+def _is_heading_text(text):
+    """Reject very short lines, bare numbers, and common form/table labels"""
+    if len(text) <= 3 or text.replace('.', '').isdigit():
+        return False
+    return text.lower() not in SKIP_PATTERNS
 
 
 def assign_heading_levels(lines):
-    # Count font size frequencies
-    font_size_counts = Counter(line['font_size'] for line in lines)
     total_lines = len(lines)
-    
+    if not total_lines:
+        return None, []
+
+    # Columnar views of the numeric line attributes: the cheap filters run
+    # vectorized, string heuristics only touch the few surviving candidates
+    sizes = np.fromiter((line['font_size'] for line in lines), dtype=np.float64, count=total_lines)
+    is_bold = np.fromiter((line['is_bold'] for line in lines), dtype=np.bool_, count=total_lines)
+
     # For PDFs with limited font sizes, use bold fonts as headings
-    bold_lines = [line for line in lines if line['is_bold']]
-    regular_lines = [line for line in lines if not line['is_bold']]
-    
-    # If we have bold text, use it as headings
-    if bold_lines:
+    bold_indices = np.nonzero(is_bold)[0]
+    if bold_indices.size:
         outline = []
-        for line in bold_lines:
+        for i in bold_indices:
+            line = lines[i]
             text = clean_heading_text(line['text'])
-            # Skip very short lines or numbers
-            if len(text) <= 3 or text.replace('.', '').isdigit():
+            if not _is_heading_text(text):
                 continue
-            # Skip common form patterns
-            skip_patterns = {'s.no', 'name', 'age', 'date', 'rs.', 'signature'}
-            if text.lower() in skip_patterns:
-                continue
-            entry = {
+            outline.append({
                 'level': 'H1',  # Treat bold text as H1
                 'text': text,
                 'page': line['page'],
                 'y_coord': line['y_coord']
-            }
-            outline.append(entry)
+            })
         return None, outline
-    
+
     # Fallback: use font size differences
+    unique_sizes, counts = np.unique(sizes, return_counts=True)
     # Most common font size is body text
-    if font_size_counts:
-        body_font_size, _ = font_size_counts.most_common(1)[0]
-        # Only consider font sizes that are rare (<20% of lines)
-        rare_font_sizes = [size for size, count in font_size_counts.items() if count / total_lines < 0.2]
-        # Sort rare font sizes descending (largest = Title, then H1, ...)
-        rare_font_sizes = sorted(rare_font_sizes, reverse=True)
-        # Map rare font sizes to heading levels
-        size_to_level = {}
-        for i, size in enumerate(rare_font_sizes[:len(HEADING_LEVELS)]):
-            size_to_level[size] = HEADING_LEVELS[i]
-        # Assign level to each line
-        outline = []
-        title_lines = []
-        for line in lines:
-            # Ignore body text font size
-            if line['font_size'] == body_font_size:
-                continue
-            level = size_to_level.get(line['font_size'])
-            if not level:
-                continue  # Not a heading
-            # Ignore lines that are just numbers or very short (<=3 chars, e.g., '1.', '2.')
-            text = clean_heading_text(line['text'])
-            if len(text) <= 3 or text.replace('.', '').isdigit():
-                continue
-            # Optionally: ignore lines that match common form/table patterns (e.g., 'S.No', 'Name', 'Age', 'Date')
-            skip_patterns = {'s.no', 'name', 'age', 'date', 'rs.', 'signature'}
-            if text.lower() in skip_patterns:
-                continue
-            if level == 'Title':
-                title_lines.append(text)
-            else:
-                entry = {
-                    'level': level,
-                    'text': text,
-                    'page': line['page'],
-                    'y_coord': line['y_coord']
-                }
-                outline.append(entry)
-        title = ' '.join(title_lines) if title_lines else None
-        return title, outline
-    
-    return None, []
+    body_font_size = unique_sizes[np.argmax(counts)]
+    # Only consider font sizes that are rare (<20% of lines),
+    # sorted descending (largest = Title, then H1, ...)
+    rare_font_sizes = unique_sizes[counts / total_lines < 0.2][::-1][:len(HEADING_LEVELS)]
+    # Map rare font sizes to heading levels
+    size_to_level = {float(size): HEADING_LEVELS[i] for i, size in enumerate(rare_font_sizes)}
+    # Select candidate lines with a vectorized membership test, ignoring body text
+    candidate_indices = np.nonzero(np.isin(sizes, rare_font_sizes) & (sizes != body_font_size))[0]
+    outline = []
+    title_lines = []
+    for i in candidate_indices:
+        line = lines[i]
+        level = size_to_level[line['font_size']]
+        text = clean_heading_text(line['text'])
+        if not _is_heading_text(text):
+            continue
+        if level == 'Title':
+            title_lines.append(text)
+        else:
+            outline.append({
+                'level': level,
+                'text': text,
+                'page': line['page'],
+                'y_coord': line['y_coord']
+            })
+    title = ' '.join(title_lines) if title_lines else None
+    return title, outline
+
+
+# Immutable heading entry; hashable so per-page heading tuples can key the
+# memoized chunk lookup. tokens is precomputed for word-overlap matching.
+Heading = namedtuple('Heading', ['text', 'level', 'y_coord', 'tokens'])
+
+# All of a document's headings flattened in (page, y) order: entries and ys are
+# parallel tuples, offsets[p]:offsets[p+1] slices out page p
+HeadingIndex = namedtuple('HeadingIndex', ['entries', 'ys', 'offsets'])
+
+_EMPTY_PAGE = ((), ())
+
+
+def _build_heading_index(outline):
+    """Flatten an outline into a (page, y)-sorted HeadingIndex"""
+    ordered = sorted(outline, key=lambda e: (e['page'], e['y_coord']))
+    entries = tuple(Heading(
+        text=entry['text'],
+        level=entry['level'],
+        y_coord=entry['y_coord'],
+        tokens=frozenset(entry['text'].lower().split())
+    ) for entry in ordered)
+    n_pages = ordered[-1]['page'] + 1 if ordered else 0
+    page_counts = np.bincount([entry['page'] for entry in ordered], minlength=n_pages)
+    offsets = np.zeros(n_pages + 1, dtype=np.int32)
+    np.cumsum(page_counts, out=offsets[1:])
+    return HeadingIndex(
+        entries=entries,
+        ys=tuple(h.y_coord for h in entries),
+        offsets=offsets
+    )
+
+
+def page_headings(heading_index, page):
+    """Slice a page's (entries, ys) out of the index in O(1)"""
+    offsets = heading_index.offsets
+    if page < 0 or page >= len(offsets) - 1:
+        return _EMPTY_PAGE
+    start, end = int(offsets[page]), int(offsets[page + 1])
+    return heading_index.entries[start:end], heading_index.ys[start:end]
 
 
 def get_headings_by_page(pdf_path):
-    """Extract headings organized by page number"""
+    """Extract headings as a page-indexed HeadingIndex"""
     lines = extract_lines_with_fonts(pdf_path)
     title, outline = assign_heading_levels(lines)
-    
-    # Group headings by page
-    headings_by_page = defaultdict(list)
-    for entry in outline:
-        headings_by_page[entry['page']].append({
-            'text': entry['text'],
-            'level': entry['level'],
-            'y_coord': entry['y_coord']
-        })
-    
-    return title, headings_by_page
+    return title, _build_heading_index(outline)
 
 
-def find_heading_for_chunk(chunk_page, chunk_text, headings_by_page):
-    """Find the most appropriate heading for a chunk based on page and content"""
-    if chunk_page not in headings_by_page:
-        return ""
-    
-    # Get headings from the same page
-    page_headings = headings_by_page[chunk_page]
-    
-    if not page_headings:
-        return ""
-    
+@functools.lru_cache(maxsize=4096)
+def _match_heading(entries, chunk_prefix):
+    """Pick the best heading from a page's entries for a chunk-text prefix"""
     # If there's only one heading on the page, use it
-    if len(page_headings) == 1:
-        return page_headings[0]['text']
-    
+    if len(entries) == 1:
+        return entries[0].text
+
     # Try to find the most relevant heading by checking if any heading text appears in the chunk
-    for heading in page_headings:
-        heading_words = set(heading['text'].lower().split())
-        chunk_words = set(chunk_text.lower().split())
-        # Check for word overlap
-        if len(heading_words.intersection(chunk_words)) > 0:
-            return heading['text']
-    
+    chunk_tokens = frozenset(chunk_prefix.lower().split())
+    for heading in entries:
+        # Check for word overlap against the heading's precomputed token set
+        if heading.tokens & chunk_tokens:
+            return heading.text
+
     # If no direct match, return the first heading (usually the main section heading)
-    return page_headings[0]['text']
+    return entries[0].text
+
+
+def find_heading_for_chunk(chunk_page, chunk_text, heading_index):
+    """Find the most appropriate heading for a chunk based on page and content"""
+    entries, _ = page_headings(heading_index, chunk_page)
+    if not entries:
+        return ""
+    # Chunks with the same page and leading text resolve identically, so the
+    # match is memoized on (page entries, 200-char prefix)
+    return _match_heading(entries, chunk_text[:200])
 
 
 def extract_chunks_with_headings(pdf_path, chunk_size=500):  # Increased from 200 to 500
     """Extract chunks with their corresponding headings"""
-    doc = fitz.open(pdf_path)
-    title, headings_by_page = get_headings_by_page(pdf_path)
-    
+    # Single parse: reuse the same "dict" result for heading detection and chunking
+    lines, page_texts = parse_pdf(pdf_path)
+    title, outline = assign_heading_levels(lines)
+    heading_index = _build_heading_index(outline)
+
     sections = []
-    for page_num in range(len(doc)):
-        page = doc[page_num]
-        text = page.get_text()
-        
-        # Simple chunking: split by paragraphs, then merge to chunk_size
+    for page_num, text in enumerate(page_texts):
+        # Simple chunking: split by paragraphs, then merge to chunk_size.
+        # Paragraphs accumulate in a list and are joined once per emitted chunk
         paras = [p.strip() for p in text.split('\n') if p.strip()]
-        chunk = ''
+        parts = []
+        parts_len = 0  # length of ' '.join(parts)
         for para in paras:
-            if len(chunk) + len(para) < chunk_size:
-                chunk += (' ' if chunk else '') + para
+            if parts_len + len(para) < chunk_size:
+                parts_len += len(para) + (1 if parts else 0)
+                parts.append(para)
             else:
-                if chunk:
+                if parts:
+                    chunk = ' '.join(parts)
                     # Find heading for this chunk
-                    heading = find_heading_for_chunk(page_num, chunk, headings_by_page)
+                    heading = find_heading_for_chunk(page_num, chunk, heading_index)
                     sections.append({
                         'text': chunk,
                         'page': page_num + 1,
                         'file': os.path.basename(pdf_path),
                         'heading': heading
                     })
-                chunk = para
-        if chunk:
+                parts = [para]
+                parts_len = len(para)
+        if parts:
+            chunk = ' '.join(parts)
             # Find heading for this chunk
-            heading = find_heading_for_chunk(page_num, chunk, headings_by_page)
+            heading = find_heading_for_chunk(page_num, chunk, heading_index)
             sections.append({
                 'text': chunk,
                 'page': page_num + 1,
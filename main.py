@@ -1,27 +1,39 @@
 import os
 import argparse
+import concurrent.futures
 import fitz  # PyMuPDF
+import torch
 from sentence_transformers import SentenceTransformer
 import numpy as np
 from qdrant_client import QdrantClient
 from qdrant_client.http import models as qmodels
 from tqdm import tqdm
 import json
+try:
+    import orjson  # C-extension encoder, much faster on large outputs
+except ImportError:
+    orjson = None
 from datetime import datetime
 import re
 from heading_extractor import extract_chunks_with_headings
 
+# --- JSON Output ---
+def write_json(path, data):
+    """Write indented JSON, using orjson when available"""
+    if orjson is not None:
+        with open(path, 'wb') as f:
+            f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+    else:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=4, ensure_ascii=False)
+
 # --- Input Generation ---
-def generate_input_json(pdfs_dir, output_file, persona, job):
-    """Generate the challenge1b_input.json format"""
-    # Get all PDF files
-    pdf_files = []
-    for fname in os.listdir(pdfs_dir):
-        if fname.lower().endswith('.pdf'):
-            pdf_files.append({
-                "filename": fname,
-                "title": fname.replace('.pdf', '')
-            })
+def generate_input_json(pdf_files, output_file, persona, job):
+    """Generate the challenge1b_input.json format from a list of PDF filenames"""
+    documents = [{
+        "filename": fname,
+        "title": fname.replace('.pdf', '')
+    } for fname in pdf_files]
     challenge_id = f"round_1b_{datetime.now().strftime('%m%d_%H%M')}"
     # Create the input format
     input_data = {
@@ -30,7 +42,7 @@ def generate_input_json(pdfs_dir, output_file, persona, job):
             "test_case_name": persona,
             "description": job
         },
-        "documents": pdf_files,
+        "documents": documents,
         "persona": {
             "role": persona
         },
@@ -39,9 +51,8 @@ def generate_input_json(pdfs_dir, output_file, persona, job):
         }
     }
     # Write to file
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(input_data, f, indent=4, ensure_ascii=False)
-    print(f"Generated {output_file} with {len(pdf_files)} documents")
+    write_json(output_file, input_data)
+    print(f"Generated {output_file} with {len(documents)} documents")
 
 # --- PDF Chunking ---
 def chunk_pdf(file_path, chunk_size=500):  # Increased from 200 to 500
@@ -50,6 +61,8 @@ def chunk_pdf(file_path, chunk_size=500):  # Increased from 200 to 500
 
 # --- Embedding Model ---
 def load_model(model_name='all-MiniLM-L6-v2'):
+    # Use every core for the CPU matmuls inside the transformer
+    torch.set_num_threads(os.cpu_count() or 1)
     return SentenceTransformer(model_name, device='cpu')
 
 # --- Qdrant Setup ---
@@ -58,35 +71,91 @@ def setup_qdrant(collection_name, dim):
     if collection_name not in [c.name for c in client.get_collections().collections]:
         client.recreate_collection(
             collection_name=collection_name,
-            vectors_config=qmodels.VectorParams(size=dim, distance=qmodels.Distance.COSINE)
+            vectors_config=qmodels.VectorParams(size=dim, distance=qmodels.Distance.COSINE),
+            on_disk_payload=True,
+            # int8 candidate retrieval with fp32 rescoring; embeddings are
+            # L2-normalized at encode time so cosine scores stay exact
+            quantization_config=qmodels.ScalarQuantization(
+                scalar=qmodels.ScalarQuantizationConfig(
+                    type=qmodels.ScalarType.INT8,
+                    quantile=0.99,
+                    always_ram=True
+                )
+            ),
+            # Modest HNSW graph in RAM: this one-shot pipeline only needs KNN
+            # over a few thousand points, so favor build speed
+            hnsw_config=qmodels.HnswConfigDiff(m=16, ef_construct=64, on_disk=False),
+            # Index immediately instead of waiting for the segment threshold
+            optimizers_config=qmodels.OptimizersConfigDiff(indexing_threshold=0)
+        )
+        # Let the length filter in search() use an index instead of a full scan
+        client.create_payload_index(
+            collection_name=collection_name,
+            field_name='text_len',
+            field_schema=qmodels.PayloadSchemaType.INTEGER
         )
     return client
 
 # --- Store Embeddings ---
 def store_sections(client, collection, model, sections):
     batch_texts = [s['text'] for s in sections]
-    embeddings = model.encode(batch_texts, batch_size=32, show_progress_bar=True, device='cpu')
-    points = []
-    for i, (vec, s) in enumerate(zip(embeddings, sections)):
-        points.append(qmodels.PointStruct(
-            id=i,
-            vector=vec.tolist(),
-            payload={
-                'file': s['file'],
-                'page': s['page'],
-                'text': s['text'],
-                'heading': s['heading']
-            }
-        ))
-    client.upsert(collection_name=collection, points=points)
+    embeddings = model.encode(batch_texts, batch_size=128, show_progress_bar=True, device='cpu',
+                              convert_to_numpy=True, normalize_embeddings=True)
+    payloads = [{
+        'file': s['file'],
+        'page': s['page'],
+        'text': s['text'],
+        'text_len': len(s['text']),
+        'heading': s['heading']
+    } for s in sections]
+    # upload_collection consumes the numpy array directly, avoiding per-point
+    # PointStruct objects and float boxing via .tolist(). wait=True keeps the
+    # old upsert guarantee that points are visible before the search runs
+    client.upload_collection(
+        collection_name=collection,
+        vectors=embeddings,
+        payload=payloads,
+        ids=list(range(len(sections))),
+        parallel=4,
+        batch_size=256,
+        wait=True
+    )
 
 # --- Query Embedding and Retrieval ---
-def search(client, collection, model, query, top_k=5):
-    qvec = model.encode([query], device='cpu')[0]
-    hits = client.search(collection_name=collection, query_vector=qvec.tolist(), limit=top_k)
+_query_vec_cache = {}
+
+
+def embed_query(model, query):
+    """Encode a query once per session, normalized for the cosine/int8 path"""
+    qvec = _query_vec_cache.get(query)
+    if qvec is None:
+        qvec = model.encode([query], device='cpu', normalize_embeddings=True)[0].tolist()
+        _query_vec_cache[query] = qvec
+    return qvec
+
+
+def search(client, collection, model, query, top_k=5, min_len=200):
+    qvec = embed_query(model, query)
+    # Filter out very short chunks server-side instead of over-fetching and
+    # discarding in Python
+    length_filter = qmodels.Filter(must=[
+        qmodels.FieldCondition(key='text_len', range=qmodels.Range(gte=min_len))
+    ])
+    hits = client.search(collection_name=collection, query_vector=qvec,
+                         limit=top_k, query_filter=length_filter)
+    if len(hits) < top_k:
+        # Not enough long sections; backfill with shorter ones from an unfiltered search
+        seen = {hit.id for hit in hits}
+        extra = client.search(collection_name=collection, query_vector=qvec, limit=top_k)
+        hits.extend(hit for hit in extra if hit.id not in seen)
+        hits = hits[:top_k]
     return hits
 
 # --- Extract Section Title ---
+_RE_NUM_PREFIX = re.compile(r'^[0-9]+\.?\s*')
+_RE_LABEL_PREFIX = re.compile(r'^[A-Z\s]+:')
+
+
 def extract_section_title(text):
     # Try to extract a meaningful title from the text
     lines = text.split('\n')
@@ -94,8 +163,8 @@ def extract_section_title(text):
         line = line.strip()
         if line and len(line) < 100 and not line.endswith('.'):
             # Remove common prefixes and clean up
-            title = re.sub(r'^[0-9]+\.?\s*', '', line)
-            title = re.sub(r'^[A-Z\s]+:', '', title)
+            title = _RE_NUM_PREFIX.sub('', line)
+            title = _RE_LABEL_PREFIX.sub('', title)
             if title.strip():
                 return title.strip()
     # If no good title found, use first sentence
@@ -138,20 +207,23 @@ def main():
     input_json_path = os.path.join(parent_dir, 'challenge1b_input.json')
     output_json_path = os.path.join(parent_dir, 'challenge1b_output.json')
 
-    # Always generate input file
-    generate_input_json(args.docs_dir, input_json_path, args.persona, args.job)
+    # 1. Scan the docs dir once (scandir avoids per-file stats) and reuse the
+    # list for both the input file and chunking
+    input_documents = sorted(entry.name for entry in os.scandir(args.docs_dir)
+                             if entry.name.lower().endswith('.pdf'))
 
-    # 1. Get list of input documents
-    input_documents = []
-    for fname in os.listdir(args.docs_dir):
-        if fname.lower().endswith('.pdf'):
-            input_documents.append(fname)
+    # Always generate input file
+    generate_input_json(input_documents, input_json_path, args.persona, args.job)
 
-    # 2. Chunk all PDFs with proper headings
+    # 2. Chunk all PDFs with proper headings (parallel across files; PyMuPDF
+    # releases the GIL during parsing, so worker processes scale with cores)
+    paths = [os.path.join(args.docs_dir, fname) for fname in input_documents]
     all_sections = []
-    for fname in input_documents:
-        fpath = os.path.join(args.docs_dir, fname)
-        all_sections.extend(chunk_pdf(fpath))
+    max_workers = min(os.cpu_count() or 1, 6)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+        # executor.map preserves input order, keeping section IDs deterministic
+        for sections in executor.map(chunk_pdf, paths):
+            all_sections.extend(sections)
 
     # 3. Load embedding model
     model = load_model()
@@ -164,19 +236,10 @@ def main():
     # 5. Store all section embeddings
     store_sections(client, collection, model, all_sections)
 
-    # 6. Embed query (persona + job)
+    # 6. Embed query (persona + job); very short chunks (< 200 chars) are
+    # filtered server-side, with shorter ones backfilled if needed
     query = f"Persona: {args.persona}. Job: {args.job}"
-    # Search for more results to get comprehensive chunks
-    hits = search(client, collection, model, query, top_k=args.top_k * 3)  # Get 3x more results
-    # Filter out very short chunks (less than 200 characters)
-    filtered_hits = [hit for hit in hits if len(hit.payload['text']) >= 200]
-    # Take the top_k from filtered results
-    final_hits = filtered_hits[:args.top_k]
-    # If we don't have enough filtered results, add back some shorter ones
-    if len(final_hits) < args.top_k:
-        remaining_needed = args.top_k - len(final_hits)
-        short_hits = [hit for hit in hits if len(hit.payload['text']) < 200]
-        final_hits.extend(short_hits[:remaining_needed])
+    final_hits = search(client, collection, model, query, top_k=args.top_k)
 
     # 7. Generate extracted sections with importance ranking
     extracted_sections = []
@@ -217,8 +280,7 @@ def main():
         'subsection_analysis': subsection_analysis
     }
 
-    with open(output_json_path, 'w', encoding='utf-8') as f:
-        json.dump(output_data, f, indent=4, ensure_ascii=False)
+    write_json(output_json_path, output_data)
     print(f"Generated {output_json_path}")
 
 if __name__ == '__main__':
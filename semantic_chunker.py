@@ -1,101 +1,116 @@
+import bisect
 import os
-import fitz  # PyMuPDF
+import functools
 import re
-from collections import defaultdict
+
+from heading_extractor import parse_pdf, assign_heading_levels, _build_heading_index, page_headings
+
+# Patterns compiled once at module load; these run per sentence/paragraph on hot paths
+_RE_SENT = re.compile(r'[.!?]+(?=\s|\n|$)')
+_RE_WS = re.compile(r'\s+')
+_RE_KEEP_CHAR = re.compile(r'[\w\s\.\,\;\:\!\?\-\(\)]')
+
+
+class _DeleteTable(dict):
+    """Lazy str.translate table that drops characters outside the kept class.
+
+    Entries are computed on first sight of a codepoint and cached, so translate
+    stays a single C-level pass without precomputing the full Unicode range.
+    """
+    def __missing__(self, code):
+        keep = chr(code) if _RE_KEEP_CHAR.match(chr(code)) else None
+        self[code] = keep
+        return keep
+
+
+_DELETE_TABLE = _DeleteTable()
+
 
 # Simple sentence tokenization without NLTK dependency
 def simple_sent_tokenize(text):
     """Simple sentence tokenization without NLTK dependency"""
     # Split on sentence endings followed by space or newline
-    sentences = re.split(r'[.!?]+(?=\s|\n|$)', text)
+    sentences = _RE_SENT.split(text)
     return [s.strip() for s in sentences if s.strip()]
 
 
 def clean_text(text):
     """Clean and normalize text"""
     # Remove extra whitespace
-    text = re.sub(r'\s+', ' ', text.strip())
+    text = _RE_WS.sub(' ', text.strip())
     # Remove special characters but keep punctuation
-    text = re.sub(r'[^\w\s\.\,\;\:\!\?\-\(\)]', '', text)
-    return text
+    return text.translate(_DELETE_TABLE)
 
 
 def is_paragraph_break(text_before, text_after):
     """Determine if there's a paragraph break between two text segments"""
     if not text_before or not text_after:
         return False
-    
-    # Check for double newlines (common paragraph break)
-    if '\n\n' in text_before[-20:] or '\n\n' in text_after[:20]:
-        return True
-    
-    # Check for sentence endings followed by capital letters (new paragraph)
-    if re.search(r'[.!?]\s+[A-Z]', text_before[-10:] + text_after[:10]):
-        return True
-    
-    return False
 
+    # Sentence ending right at the boundary followed by a capital letter, or
+    # double newlines near it (common paragraph break); plain string checks
+    # beat a regex scan here since this runs once per line pair
+    return ((text_before.endswith(('.', '!', '?')) and text_after[:1].isupper())
+            or '\n\n' in text_before[-20:] or '\n\n' in text_after[:20])
 
-def extract_paragraphs_with_positioning(pdf_path):
-    """Extract paragraphs with their positioning information using improved logic"""
-    doc = fitz.open(pdf_path)
+
+def _build_paragraphs(lines):
+    """Group font-annotated lines into positioned paragraphs, page by page"""
     paragraphs = []
-    
-    for page_num, page in enumerate(doc):
-        # Get text blocks with positioning
-        blocks = page.get_text("dict")['blocks']
-        page_paragraphs = []
-        current_paragraph = ""
-        current_y_start = None
-        current_y_end = None
-        
-        for block in blocks:
-            if block['type'] != 0:  # Skip non-text blocks
-                continue
-            
-            for line in block['lines']:
-                line_text = " ".join([span['text'] for span in line['spans']]).strip()
-                if not line_text:
-                    continue
-                
-                y_coord = min(span['bbox'][1] for span in line['spans'])
-                
-                # Check if this line starts a new paragraph
-                if not current_paragraph or is_paragraph_break(current_paragraph, line_text):
-                    # Save previous paragraph if it exists
-                    if current_paragraph:
-                        page_paragraphs.append({
-                            'text': current_paragraph.strip(),
-                            'y_start': current_y_start,
-                            'y_end': current_y_end or current_y_start
-                        })
-                    
-                    # Start new paragraph
-                    current_paragraph = line_text
-                    current_y_start = y_coord
-                    current_y_end = y_coord
-                else:
-                    # Continue current paragraph
-                    current_paragraph += " " + line_text
-                    current_y_end = y_coord
-        
-        # Add the last paragraph
+    current_page = None
+    current_paragraph = ""
+    current_y_start = None
+    current_y_end = None
+
+    def flush():
         if current_paragraph:
-            page_paragraphs.append({
+            paragraphs.append({
                 'text': current_paragraph.strip(),
                 'y_start': current_y_start,
-                'y_end': current_y_end or current_y_start
+                'y_end': current_y_end or current_y_start,
+                'page': current_page + 1
             })
-        
-        # Add page number to each paragraph
-        for para in page_paragraphs:
-            para['page'] = page_num + 1
-        
-        paragraphs.extend(page_paragraphs)
-    
+
+    for line in lines:
+        line_text = line['text']
+        y_coord = line['y_coord']
+
+        # Check if this line starts a new paragraph (page changes always do)
+        if (line['page'] != current_page or not current_paragraph
+                or is_paragraph_break(current_paragraph, line_text)):
+            # Save previous paragraph if it exists
+            flush()
+            # Start new paragraph
+            current_page = line['page']
+            current_paragraph = line_text
+            current_y_start = y_coord
+            current_y_end = y_coord
+        else:
+            # Continue current paragraph
+            current_paragraph += " " + line_text
+            current_y_end = y_coord
+
+    # Add the last paragraph
+    flush()
+
     return paragraphs
 
 
+def extract_paragraphs_with_positioning(pdf_path):
+    """Extract paragraphs with their positioning information using improved logic"""
+    lines, _ = parse_pdf(pdf_path)
+    return _build_paragraphs(lines)
+
+
+@functools.lru_cache(maxsize=8)
+def _parse_pdf_layout(pdf_path, mtime):
+    """Derive paragraphs and page headings from a single cached PDF parse"""
+    lines, _ = parse_pdf(pdf_path)
+    paragraphs = _build_paragraphs(lines)
+    title, outline = assign_heading_levels(lines)
+    return paragraphs, _build_heading_index(outline)
+
+
 def segment_sentences(text):
     """Segment text into sentences using simple regex"""
     return simple_sent_tokenize(text)
@@ -104,19 +119,24 @@ def segment_sentences(text):
 def create_simple_chunks(paragraphs, min_chunk_size=500, max_chunk_size=800):
     """Create simple chunks from paragraphs with sentence boundaries"""
     chunks = []
-    current_chunk = ""
+    current_parts = []  # Paragraph texts in current chunk; joined only on emit
+    current_len = 0  # Length of ' '.join(current_parts)
     current_page = None
     current_y_start = None
     current_paragraphs = []  # Track paragraphs in current chunk
-    
+    # Sentence view of the current chunk, maintained incrementally so overflows
+    # don't re-tokenize the whole accumulated text
+    current_sentences = []
+    sentence_open = False  # True when the chunk ends mid-sentence (no terminator)
+
     for para in paragraphs:
         para_text = para['text']
         para_size = len(para_text)
-        
+
         # If adding this paragraph would exceed max size and we have content
-        if current_chunk and len(current_chunk) + para_size > max_chunk_size:
+        if current_parts and current_len + para_size > max_chunk_size:
             # Check if we can split at sentence boundary
-            sentences = segment_sentences(current_chunk)
+            sentences = current_sentences
             if len(sentences) > 1:
                 # Take all but the last sentence to stay within limits
                 chunk_text = '. '.join(sentences[:-1]) + '.'
@@ -129,93 +149,107 @@ def create_simple_chunks(paragraphs, min_chunk_size=500, max_chunk_size=800):
                         'y_start': chunk_y_start
                     })
                     # Start new chunk with the last sentence
-                    current_chunk = sentences[-1]
+                    last_sentence = sentences[-1]
+                    current_parts = [last_sentence]
+                    current_len = len(last_sentence)
                     current_paragraphs = [{'y_start': para['y_start']}]  # Reset with current paragraph
+                    current_sentences = [last_sentence]
+                    sentence_open = last_sentence[-1:] not in '.!?'
                 else:
                     # Keep the whole chunk if it's too small
                     chunk_y_start = current_paragraphs[0]['y_start'] if current_paragraphs else current_y_start
                     chunks.append({
-                        'text': current_chunk,
+                        'text': ' '.join(current_parts),
                         'page': current_page,
                         'y_start': chunk_y_start
                     })
-                    current_chunk = para_text
+                    current_parts = [para_text]
+                    current_len = para_size
                     current_paragraphs = [para]
+                    current_sentences = segment_sentences(para_text)
+                    sentence_open = para_text[-1:] not in '.!?'
             else:
                 # No sentence boundary, just add the chunk
                 chunk_y_start = current_paragraphs[0]['y_start'] if current_paragraphs else current_y_start
                 chunks.append({
-                    'text': current_chunk,
+                    'text': ' '.join(current_parts),
                     'page': current_page,
                     'y_start': chunk_y_start
                 })
-                current_chunk = para_text
+                current_parts = [para_text]
+                current_len = para_size
                 current_paragraphs = [para]
+                current_sentences = segment_sentences(para_text)
+                sentence_open = para_text[-1:] not in '.!?'
         else:
             # Add to current chunk
-            if current_chunk:
-                current_chunk += " " + para_text
+            if current_parts:
+                current_parts.append(para_text)
+                current_len += 1 + para_size
                 current_paragraphs.append(para)
+                # Tokenize only the new paragraph; if the chunk ended mid-sentence
+                # the joined text reads straight on, so merge the first piece
+                # (unless the paragraph opens with terminators that close it)
+                new_sentences = segment_sentences(para_text)
+                if (sentence_open and current_sentences and new_sentences
+                        and not _RE_SENT.match(para_text)):
+                    current_sentences[-1] += ' ' + new_sentences[0]
+                    current_sentences.extend(new_sentences[1:])
+                else:
+                    current_sentences.extend(new_sentences)
+                sentence_open = para_text[-1:] not in '.!?'
             else:
-                current_chunk = para_text
+                current_parts = [para_text]
+                current_len = para_size
                 current_page = para['page']
                 current_y_start = para['y_start']
                 current_paragraphs = [para]
-    
+                current_sentences = segment_sentences(para_text)
+                sentence_open = para_text[-1:] not in '.!?'
+
     # Add the last chunk
-    if current_chunk:
+    if current_parts:
         chunk_y_start = current_paragraphs[0]['y_start'] if current_paragraphs else current_y_start
         chunks.append({
-            'text': current_chunk,
+            'text': ' '.join(current_parts),
             'page': current_page,
             'y_start': chunk_y_start
         })
-    
+
     return chunks
 
 
-def find_heading_for_chunk(chunk, headings_by_page):
-    """Find the most appropriate heading for a chunk using improved positioning and content logic"""
-    page_num = chunk['page']
-    chunk_y = chunk['y_start']
-    chunk_text = chunk['text'].lower()
-    
-    if page_num not in headings_by_page:
-        return ""
-    
-    page_headings = headings_by_page[page_num]
-    
-    if not page_headings:
-        return ""
-    
+@functools.lru_cache(maxsize=4096)
+def _match_heading_positional(entries, ys, chunk_prefix, y_bucket):
+    """Pick the best heading for a chunk prefix and bucketed y-position"""
     # If there's only one heading on the page, use it
-    if len(page_headings) == 1:
-        return page_headings[0]['text']
-    
+    if len(entries) == 1:
+        return entries[0].text
+
     # First, try to find a heading that appears in the chunk text (content-based)
-    for heading in page_headings:
-        heading_text = heading['text'].lower()
-        # Check for exact match or partial match
-        if heading_text in chunk_text or any(word in chunk_text for word in heading_text.split()):
-            return heading['text']
-    
-    # If no heading appears in the text, try positioning-based approach
-    headings_above = [h for h in page_headings if h['y_coord'] <= chunk_y]
-    
-    if headings_above:
-        # Return the heading with the highest y-coordinate (closest to the chunk)
-        closest_heading = max(headings_above, key=lambda x: x['y_coord'])
-        return closest_heading['text']
-    else:
-        # If no heading is above the chunk, find the closest heading below
-        headings_below = [h for h in page_headings if h['y_coord'] > chunk_y]
-        if headings_below:
-            # Return the heading with the lowest y-coordinate (closest below)
-            closest_heading = min(headings_below, key=lambda x: x['y_coord'])
-            return closest_heading['text']
-        else:
-            # If no headings below either, return the first heading on the page
-            return page_headings[0]['text'] if page_headings else ""
+    chunk_text = chunk_prefix.lower()
+    chunk_tokens = frozenset(chunk_text.split())
+    for heading in entries:
+        # Check for exact match or word overlap (token sets precomputed upstream)
+        if heading.text.lower() in chunk_text or heading.tokens & chunk_tokens:
+            return heading.text
+
+    # If no heading appears in the text, bisect the y-sorted headings: the one
+    # just above the chunk wins, else the closest one below
+    chunk_y = y_bucket * 20.0
+    idx = bisect.bisect_right(ys, chunk_y)
+    return entries[idx - 1].text if idx else entries[0].text
+
+
+def find_heading_for_chunk(chunk, heading_index):
+    """Find the most appropriate heading for a chunk using improved positioning and content logic"""
+    entries, ys = page_headings(heading_index, chunk['page'])
+    if not entries:
+        return ""
+    # Memoized on (page entries, 200-char prefix, 20pt y bucket): chunks that
+    # start alike and sit in the same band resolve to the same heading
+    return _match_heading_positional(entries, ys, chunk['text'][:200],
+                                     int(chunk['y_start'] // 20))
 
 
 def extract_chunks_with_headings(pdf_path, chunk_size=800):
@@ -226,20 +260,17 @@ def extract_chunks_with_headings(pdf_path, chunk_size=800):
         pdf_path: Path to the PDF file
         chunk_size: Maximum chunk size in characters (default 800)
     """
-    # Extract paragraphs with positioning
-    paragraphs = extract_paragraphs_with_positioning(pdf_path)
-    
+    # Paragraphs and headings come from the same cached single-pass parse
+    paragraphs, heading_index = _parse_pdf_layout(os.path.abspath(pdf_path),
+                                                  os.path.getmtime(pdf_path))
+
     # Create simple chunks with sentence boundaries
     chunks = create_simple_chunks(paragraphs, min_chunk_size=500, max_chunk_size=chunk_size)
-    
-    # Get headings for context
-    from heading_extractor import get_headings_by_page
-    title, headings_by_page = get_headings_by_page(pdf_path)
-    
+
     # Convert chunks to the expected format
     sections = []
     for chunk in chunks:
-        heading = find_heading_for_chunk(chunk, headings_by_page)
+        heading = find_heading_for_chunk(chunk, heading_index)
         
         sections.append({
             'text': chunk['text'],